@@ -55,6 +55,7 @@
 import java
 import java.beans
 import socket
+import select
 import threading
 import time
 from org.apache.log4j import Logger
@@ -64,6 +65,13 @@ TcpPeripheral_log = Logger.getLogger("jmri.jmrit.jython.exec.TcpPeripheral")
 
 CONN_TIMEOUT = 3.0 # timeout (seconds)
 MAX_HEARTBEAT_FAIL = 5 # multiply by CONN_TIMEOUT for maximum time interval (send heartbeat after CONN_TIMEOUT * (MAX_HEARTBEAT_FAIL / 2))
+RECV_BUFFER_SIZE = 4096 # maximum bytes read from a socket at once
+SEND_DELAY = 0.005 # messages sent within this interval (seconds) are grouped in a single write (e.g. when setting a route)
+
+TcpPeripheral_sensorCache = {} # (alias, gpio) -> Sensor receiving the feedback from a network device
+TcpPeripheral_sensorFeedback = {} # (alias, gpio) -> last Sensor state reported by a network device
+TcpPeripheral_sensorState = {True: jmri.Sensor.ACTIVE, False: jmri.Sensor.INACTIVE} # input value -> Sensor state (True - input is connected to ground)
+TcpPeripheral_turnoutOutput = {jmri.Turnout.CLOSED: True, jmri.Turnout.THROWN: False} # Turnout state -> output (CLOSED - set output to +V / THROWN - set output to ground)
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 # get gpio and id from turnout or sensor system name
@@ -82,7 +90,7 @@ def TcpPeripheral_getGpioId(sysName):
     return gpio, id
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-# this is the code to be executed for a new network device
+# this is the code to be executed for a new network device (connects in the background - see TcpPeripheral_waitDevices)
 def TcpPeripheral_addDevice(id):
     alias = id.lower()
     _aux = id.split(":")
@@ -91,22 +99,28 @@ def TcpPeripheral_addDevice(id):
         port = int(_aux[1])
     except: # invalid port
         port = 10000 # default
-    if alias not in TcpPeripheral_sockets:
-        TcpPeripheral_sockets[alias] = TcpPeripheral_clientTcpThread(alias, TcpPeripheral_clientTcpThread_callback(), host, port)
-        TcpPeripheral_sockets[alias].start()
-    count = MAX_HEARTBEAT_FAIL # loop n times max (use this constant for convenience)
-    while (not TcpPeripheral_sockets[alias].isAtive) and (count > 0): # try to wait for slow connection
-        count -= 1
-        time.sleep(CONN_TIMEOUT)
+    thread = TcpPeripheral_sockets.get(alias)
+    if thread == None: # new device
+        thread = TcpPeripheral_clientTcpThread(alias, TcpPeripheral_clientTcpThread_callback(), host, port)
+        TcpPeripheral_sockets[alias] = thread
+        thread.start()
+    return
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# this is the code to be executed to wait for all network devices to connect (all devices connect at the same time)
+def TcpPeripheral_waitDevices():
+    deadline = time.time() + CONN_TIMEOUT * MAX_HEARTBEAT_FAIL
+    for alias in list(TcpPeripheral_sockets):
+        TcpPeripheral_sockets[alias].ready.wait(max(0, deadline - time.time())) # try to wait for slow connection (returns as soon as connected)
     return
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 # this is the code to be executed to close and remove a network device
 def TcpPeripheral_removeDevice(id):
     alias = id.lower()
-    if alias in TcpPeripheral_sockets:
-        TcpPeripheral_sockets[alias].stop()
-        del TcpPeripheral_sockets[alias]
+    thread = TcpPeripheral_sockets.pop(alias, None)
+    if thread != None:
+        thread.stop()
     return
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
@@ -114,22 +128,25 @@ def TcpPeripheral_removeDevice(id):
 def TcpPeripheral_sendToDevice(out, gpio, active, id):
     alias = id.lower()
     if out:
-        msg = "OUT:" + str(gpio) + ":" + ("1" if active else "0")
+        msg = "OUT:%d:%d" % (gpio, 1 if active else 0)
     else:
-        msg = "IN:" + str(gpio)
+        msg = "IN:%d" % gpio
     sent = TcpPeripheral_sockets[alias].send(msg)
     return sent
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 # this is the code to be executed when a valid sensor status is received from a network device
 def TcpPeripheral_receivedFromDevice(alias, gpio, value):
-    sensorSysName = "IS.IOT$" + str(gpio) + ":" + alias.upper()
-    sensor = sensors.getBySystemName(sensorSysName)
+    sensor = TcpPeripheral_sensorCache.get((alias, gpio))
+    if sensor == None: # not found yet
+        sensorSysName = "IS.IOT$" + str(gpio) + ":" + alias.upper()
+        sensor = sensors.getBySystemName(sensorSysName)
+        if sensor != None:
+            TcpPeripheral_sensorCache[(alias, gpio)] = sensor
     if sensor != None: # sensor exists
-        if value:
-            sensor.setKnownState(jmri.Sensor.ACTIVE)
-        else:
-            sensor.setKnownState(jmri.Sensor.INACTIVE)
+        state = TcpPeripheral_sensorState[value]
+        TcpPeripheral_sensorFeedback[(alias, gpio)] = state # so the listener does not request it again
+        sensor.setKnownState(state)
     else: # sensor does not exist
         TcpPeripheral_log.error("'TcpPeripheral' - " + alias + ": Feedback for non-existent Sensor [" + sensorSysName + "]")
     return
@@ -141,17 +158,20 @@ class TcpPeripheral_clientTcpThread_callback(object):
 #---------------------------------------------------------------------------------
 # this is the code to be executed when a message is received
     def processRecvMsg(self, clientTcpThread, msg):
-        TcpPeripheral_log.debug("'TcpPeripheral' - " + clientTcpThread.alias + ": Received [" + msg + "]")
-        _msg = msg.split(":")
+        if TcpPeripheral_log.isDebugEnabled():
+            TcpPeripheral_log.debug("'TcpPeripheral' - " + clientTcpThread.alias + ": Received [" + msg + "]")
         alias = clientTcpThread.alias
-        if len(_msg) == 3 and _msg[0].upper() == "IN":
+        sep1 = msg.find(":")
+        sep2 = msg.find(":", sep1 + 1)
+        if sep1 == 2 and sep2 > 0 and msg.find(":", sep2 + 1) < 0 and msg[:2].upper() == "IN": # IN:<gpio>:<value>
             try:
-                gpio = int(_msg[1])
+                gpio = int(msg[sep1 + 1:sep2])
             except: # invalid GPIO
                 gpio = 9999
-            if _msg[2] == "1":
+            value = msg[sep2 + 1:]
+            if value == "1":
                 TcpPeripheral_receivedFromDevice(alias, gpio, True)
-            if _msg[2] == "0":
+            elif value == "0":
                 TcpPeripheral_receivedFromDevice(alias, gpio, False)
         else: # invalid feedback
             TcpPeripheral_log.error("'TcpPeripheral' - " + alias + ": Invalid feedback [" + msg + "]")
@@ -175,55 +195,66 @@ class TcpPeripheral_clientTcpThread(threading.Thread):
         self.callback = callback
         self.ip = ip
         self.port = port
-        self.received = ""
+        self.received = bytearray() # changed in place (no string copy per received message)
         self.isAtive = False
+        self.ready = threading.Event() # set while connected
         self.exit = False
         self.sock = None
+        self.sendLock = threading.Lock()
+        self.writeLock = threading.Lock() # one write at a time on the socket
+        self.pending = [] # messages waiting to be sent together
+        self.flushTimer = None
         return
 
 #---------------------------------------------------------------------------------
 # this is the code to be executed on start
     def run(self):
         self.connect() # connect
-        heartbeatFailCount = 0
         heartbeatCtrl = time.time() # start heartbeat delay
+        receivedCtrl = time.time() # start heartbeat timeout
         while not self.exit:
-            if (time.time() - heartbeatCtrl) > (CONN_TIMEOUT * (MAX_HEARTBEAT_FAIL / 2)): # send only after appropriate delay
-                self.sock.sendall(" ") # send heartbeat
-                heartbeatCtrl = time.time() # restart heartbeat delay
             try:
-                received = self.sock.recv(256)
-                if received:
-                    TcpPeripheral_log.debug("'TcpPeripheral' - " + self.alias + ": Received (including heartbeat) [" + received + "]")
-                    heartbeatFailCount = 0
-                    self.received += received.replace(" ", "") # remove spaces (heartbeat)
-                    cmds = self.received.split("|")
-                    if len(cmds) > 0:
-                        for cmd in cmds:
-                            if cmd: # if not empty
-                                self.callback.processRecvMsg(self, cmd)
+                if (time.time() - heartbeatCtrl) > (CONN_TIMEOUT * (MAX_HEARTBEAT_FAIL / 2)): # send only after appropriate delay
+                    with self.writeLock:
+                        self.sock.sendall(" ") # send heartbeat
+                    heartbeatCtrl = time.time() # restart heartbeat delay
+                waitTime = min(heartbeatCtrl + (CONN_TIMEOUT * (MAX_HEARTBEAT_FAIL / 2)), receivedCtrl + (CONN_TIMEOUT * MAX_HEARTBEAT_FAIL)) - time.time()
+                readable = select.select([self.sock], [], [], max(waitTime, 0))[0] # wait for data, next heartbeat or heartbeat timeout
+                if readable:
+                    received = self.sock.recv(RECV_BUFFER_SIZE)
+                    if received:
+                        if TcpPeripheral_log.isDebugEnabled():
+                            TcpPeripheral_log.debug("'TcpPeripheral' - " + self.alias + ": Received (including heartbeat) [" + received + "]")
+                        receivedCtrl = time.time() # restart heartbeat timeout
+                        self.received.extend(received.replace(" ", "")) # remove spaces (heartbeat)
                         procChars = self.received.rfind("|")
-                        self.received = self.received[procChars:]
-                else:
-                    TcpPeripheral_log.error("'TcpPeripheral' - " + self.alias + ": Connection broken - closing socket")
-                    self.sock.close()
-                    self.isAtive = False
-                    self.connect() # reconnect
-                    heartbeatFailCount = 0
-            except socket.timeout as e:
-                heartbeatFailCount += 1
-                if heartbeatFailCount > MAX_HEARTBEAT_FAIL:
+                        if procChars >= 0: # at least one complete command
+                            cmds = str(self.received[:procChars]).split("|")
+                            del self.received[:procChars + 1] # keep the unterminated command until the rest is received
+                            for cmd in cmds:
+                                if cmd: # if not empty
+                                    self.callback.processRecvMsg(self, cmd)
+                    else:
+                        TcpPeripheral_log.error("'TcpPeripheral' - " + self.alias + ": Connection broken - closing socket")
+                        self.sock.close()
+                        self.isAtive = False
+                        self.ready.clear()
+                        self.connect() # reconnect
+                        receivedCtrl = time.time()
+                elif (time.time() - receivedCtrl) > (CONN_TIMEOUT * MAX_HEARTBEAT_FAIL):
                     TcpPeripheral_log.error("'TcpPeripheral' - " + self.alias + ": Heartbeat timeout - closing socket")
                     self.sock.close()
                     self.isAtive = False
+                    self.ready.clear()
                     self.connect() # reconnect
-                    heartbeatFailCount = 0
+                    receivedCtrl = time.time()
             except:
                 TcpPeripheral_log.error("'TcpPeripheral' - " + self.alias + ": Connection reset by peer - closing socket")
                 self.sock.close()
                 self.isAtive = False
+                self.ready.clear()
                 self.connect() # reconnect
-                heartbeatFailCount = 0
+                receivedCtrl = time.time()
         self.callback.onFinished(self, "Finished")
         return
 
@@ -240,8 +271,19 @@ class TcpPeripheral_clientTcpThread(threading.Thread):
                 self.sock = None
                 time.sleep(CONN_TIMEOUT)
             else:
+                try: # best effort (the connection also works without these options)
+                    self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # send short commands immediately (no Nagle delay)
+                    self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) # let the OS detect half-open connections
+                    if hasattr(socket, "TCP_KEEPIDLE"): # keepalive timing is only tunable on some platforms (e.g. Linux)
+                        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, int(CONN_TIMEOUT * MAX_HEARTBEAT_FAIL))
+                        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, int(CONN_TIMEOUT))
+                        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, MAX_HEARTBEAT_FAIL)
+                except socket.error as e:
+                    TcpPeripheral_log.warn("'TcpPeripheral' - " + self.alias + ": Socket options not set - " + str(e))
                 TcpPeripheral_log.info("'TcpPeripheral' - " + self.alias + ": Connected to '%s' port %s" % server_address)
+                del self.received[:] # discard any unterminated command from a previous connection
                 self.isAtive = True
+                self.ready.set()
                 break # continue because connection is done
         return
 
@@ -249,46 +291,91 @@ class TcpPeripheral_clientTcpThread(threading.Thread):
 # this is the code to be executed to send a message
     def send(self, msg):
         if self.isAtive:
-            TcpPeripheral_log.debug("'TcpPeripheral' - '" + self.alias + "' sending message: " + msg)
-            try:
-                self.sock.sendall(msg + "|") # add end of command delimiter
-            except:
-                TcpPeripheral_log.error("'TcpPeripheral' - " + self.alias + ": Error sending - closing socket")
-                self.sock.close()
-                self.isAtive = False
-                self.connect() # reconnect
-                heartbeatFailCount = 0
+            if TcpPeripheral_log.isDebugEnabled():
+                TcpPeripheral_log.debug("'TcpPeripheral' - '" + self.alias + "' sending message: " + msg)
+            with self.sendLock:
+                self.pending.append(msg)
+                if self.flushTimer == None: # first message of a burst - send it (and the ones that follow) after a short delay
+                    self.flushTimer = threading.Timer(SEND_DELAY, self.flush)
+                    self.flushTimer.start()
         else:
             TcpPeripheral_log.error("'TcpPeripheral' - '" + self.alias + "' message [" + msg + "] not sent")
         return self.isAtive
 
+#---------------------------------------------------------------------------------
+# this is the code to be executed to send all pending messages at once
+    def flush(self):
+        with self.writeLock: # bursts are taken and written in order (a slow write must not be overtaken by the next burst)
+            with self.sendLock:
+                msgs = self.pending
+                self.pending = []
+                self.flushTimer = None
+            sock = self.sock
+            if sock == None: # reconnecting
+                TcpPeripheral_log.error("'TcpPeripheral' - '" + self.alias + "' messages [" + "|".join(msgs) + "] not sent")
+                return
+            try:
+                sock.sendall("|".join(msgs) + "|") # add end of command delimiter
+            except:
+                TcpPeripheral_log.error("'TcpPeripheral' - " + self.alias + ": Error sending - closing socket")
+                if sock is self.sock: # not yet replaced by a new connection
+                    self.isAtive = False
+                    self.ready.clear()
+                    try:
+                        sock.shutdown(socket.SHUT_RDWR) # wake up the receiving loop at once (close alone does not end its select)
+                    except: # ignore possible error if connection not ok
+                        pass
+                    sock.close() # the receiving loop will detect it and reconnect
+        return
+
 #---------------------------------------------------------------------------------
 # this is the code to be executed to close the socket and exit
     def stop(self):
         TcpPeripheral_log.info("'TcpPeripheral' - " + self.alias + ": Stop the socket thread - closing socket")
+        with self.sendLock: # drop a burst still waiting to be sent
+            if self.flushTimer != None:
+                self.flushTimer.cancel()
+                self.flushTimer = None
+            self.pending = []
+        self.exit = True # set before waking up the receiving loop, so it does not reconnect
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR) # wake up the receiving loop at once (close alone does not end its select)
+        except: # ignore possible error if connection not ok
+            pass
         try:
             self.sock.close()
         except: # ignore possible error if connection not ok
             pass
         finally:
             self.isAtive = False
-            self.exit = True
+            self.ready.clear()
         return
 
 #=================================================================================
 # define the listener class for Sensors
 class TcpPeripheral_Sensor_Listener(java.beans.PropertyChangeListener):
 
+#---------------------------------------------------------------------------------
+# this is the code to be executed when the class is instantiated
+    def __init__(self, gpio, id):
+        self.gpio = gpio # parsed once from the sensor system name
+        self.id = id
+        self.feedbackKey = (id.lower(), gpio)
+        return
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def propertyChange(self, event):
+        if event.propertyName != "KnownState" or event.newValue == event.oldValue: # only a change of this property matters
+            return
         sensor = event.getSource()
-        sensorName = sensor.getDisplayName(jmri.NamedBean.DisplayOptions.USERNAME_SYSTEMNAME)
-        TcpPeripheral_log.debug("'TcpPeripheral' - Sensor=" + sensorName + " property=" + event.propertyName + "]: oldValue=" + str(event.oldValue) + " newValue=" + str(event.newValue))
-        if event.propertyName == "KnownState": # only this property matters
-            gpio, id = TcpPeripheral_getGpioId(sensor.getSystemName())
-            sent = TcpPeripheral_sendToDevice(False, gpio, None, id)
-            if not sent: # set as unknown
-                sensor.setKnownState(jmri.Sensor.UNKNOWN)
+        if TcpPeripheral_log.isDebugEnabled():
+            sensorName = sensor.getDisplayName(jmri.NamedBean.DisplayOptions.USERNAME_SYSTEMNAME)
+            TcpPeripheral_log.debug("'TcpPeripheral' - Sensor=" + sensorName + " property=" + event.propertyName + "]: oldValue=" + str(event.oldValue) + " newValue=" + str(event.newValue))
+        if event.newValue == TcpPeripheral_sensorFeedback.get(self.feedbackKey): # state set by the device itself - no need to request it
+            return
+        sent = TcpPeripheral_sendToDevice(False, self.gpio, None, self.id)
+        if not sent: # set as unknown
+            sensor.setKnownState(jmri.Sensor.UNKNOWN)
         return
 
 #=================================================================================
@@ -297,28 +384,30 @@ class TcpPeripheral_Turnout_Listener(java.beans.PropertyChangeListener):
 
 #---------------------------------------------------------------------------------
 # this is the code to be executed when the class is instantiated
-    def __init__(self):
+    def __init__(self, gpio, id):
+        self.gpio = gpio # parsed once from the turnout system name
+        self.id = id
         self.turnoutCtrl = None # for turnout restore control
         return
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def propertyChange(self, event):
+        if event.propertyName != "CommandedState": # only this property matters
+            return
         turnout = event.getSource()
-        turnoutName = turnout.getDisplayName(jmri.NamedBean.DisplayOptions.USERNAME_SYSTEMNAME)
-        TcpPeripheral_log.debug("'TcpPeripheral' - Turnout=" + turnoutName + " property=" + event.propertyName + "]: oldValue=" + str(event.oldValue) + " newValue=" + str(event.newValue) + " turnoutCtrl=" + str(self.turnoutCtrl))
-        if event.propertyName == "CommandedState": # only this property matters
-            if event.newValue != self.turnoutCtrl: # this is a state change request
-                gpio, id = TcpPeripheral_getGpioId(turnout.getSystemName())
-                sent = True
-                if event.newValue == jmri.Turnout.CLOSED:
-                    sent = TcpPeripheral_sendToDevice(True, gpio, True, id)
-                if event.newValue == jmri.Turnout.THROWN:
-                    sent = TcpPeripheral_sendToDevice(True, gpio, False, id)
-                if sent: # store the current state
-                    self.turnoutCtrl = event.newValue
-                else: # restore turnout state
-                    self.turnoutCtrl = event.oldValue
-                    turnout.setCommandedState(event.oldValue)
+        if TcpPeripheral_log.isDebugEnabled():
+            turnoutName = turnout.getDisplayName(jmri.NamedBean.DisplayOptions.USERNAME_SYSTEMNAME)
+            TcpPeripheral_log.debug("'TcpPeripheral' - Turnout=" + turnoutName + " property=" + event.propertyName + "]: oldValue=" + str(event.oldValue) + " newValue=" + str(event.newValue) + " turnoutCtrl=" + str(self.turnoutCtrl))
+        if event.newValue != self.turnoutCtrl: # this is a state change request
+            sent = True
+            active = TcpPeripheral_turnoutOutput.get(event.newValue)
+            if active != None: # CLOSED or THROWN
+                sent = TcpPeripheral_sendToDevice(True, self.gpio, active, self.id)
+            if sent: # store the current state
+                self.turnoutCtrl = event.newValue
+            else: # restore turnout state
+                self.turnoutCtrl = event.oldValue
+                turnout.setCommandedState(event.oldValue)
         return
 
 #=================================================================================
@@ -328,13 +417,13 @@ class TcpPeripheral_ShutDown(jmri.implementation.AbstractShutDownTask):
 #---------------------------------------------------------------------------------
 # this is the code to be invoked when the program is shutting down
     def run(self):
-        auxList = []
-        for alias in TcpPeripheral_sockets:
-            auxList.append(alias)
-        for alias in auxList:
+        threads = list(TcpPeripheral_sockets.values())
+        for alias in list(TcpPeripheral_sockets):
             TcpPeripheral_removeDevice(alias)
         TcpPeripheral_log.info("Shutting down 'TcpPeripheral'.")
-        time.sleep(3) # wait 3 seconds for all sockets to close
+        deadline = time.time() + 3 # wait up to 3 seconds for all sockets to close
+        for thread in threads:
+            thread.join(max(0, deadline - time.time()))
         return
 
 #*********************************************************************************
@@ -346,23 +435,37 @@ else: # Continue running script
     TcpPeripheral_running = True
     TcpPeripheral_sockets = {}
     shutdown.register(TcpPeripheral_ShutDown("TcpPeripheral"))
+    TcpPeripheral_deviceIds = set() # each network device only once
+    TcpPeripheral_sensorBeans = [] # (sensor, gpio, id) for each sensor on a network device
     for sensor in sensors.getNamedBeanSet():
-        gpio, id = TcpPeripheral_getGpioId(sensor.getSystemName())
-        TcpPeripheral_log.debug("'TcpPeripheral' - Sensor SystemName [" + sensor.getSystemName() + "] GPIO [" + str(gpio) + "] ID [" + str(id) + "]")
+        sysName = sensor.getSystemName()
+        gpio, id = TcpPeripheral_getGpioId(sysName)
+        if TcpPeripheral_log.isDebugEnabled():
+            TcpPeripheral_log.debug("'TcpPeripheral' - Sensor SystemName [" + sysName + "] GPIO [" + str(gpio) + "] ID [" + str(id) + "]")
         if gpio != None and id != None:
-            TcpPeripheral_addDevice(id)
-            sensor.setKnownState(jmri.Sensor.INCONSISTENT) # set sensor to inconsistent state (just to detect change to unknown)
-            sensor.addPropertyChangeListener(TcpPeripheral_Sensor_Listener())
-            sensor.setKnownState(jmri.Turnout.UNKNOWN) # to force send a register request to device
+            TcpPeripheral_sensorBeans.append((sensor, gpio, id))
+            TcpPeripheral_deviceIds.add(id)
+    TcpPeripheral_turnoutBeans = [] # (turnout, gpio, id) for each turnout on a network device
     for turnout in turnouts.getNamedBeanSet():
-        gpio, id = TcpPeripheral_getGpioId(turnout.getSystemName())
-        TcpPeripheral_log.debug("'TcpPeripheral' - Turnout SystemName [" + turnout.getSystemName() + "] GPIO [" + str(gpio) + "] ID [" + str(id) + "] Kown State [" + str(turnout.getKnownState()) + "]")
+        sysName = turnout.getSystemName()
+        gpio, id = TcpPeripheral_getGpioId(sysName)
+        if TcpPeripheral_log.isDebugEnabled():
+            TcpPeripheral_log.debug("'TcpPeripheral' - Turnout SystemName [" + sysName + "] GPIO [" + str(gpio) + "] ID [" + str(id) + "] Kown State [" + str(turnout.getKnownState()) + "]")
         if gpio != None and id != None: # should be a valid network device and GPIO
-            TcpPeripheral_addDevice(id)
-            currentState = turnout.getCommandedState() # get current turnout state
-            turnout.setCommandedState(jmri.Turnout.UNKNOWN) # set turnout to a state that will permit change detection by listener
-            turnout.addPropertyChangeListener(TcpPeripheral_Turnout_Listener())
-            if currentState == jmri.Turnout.CLOSED:
-                turnout.setCommandedState(jmri.Turnout.CLOSED)
-            if currentState == jmri.Turnout.THROWN:
-                turnout.setCommandedState(jmri.Turnout.THROWN)
+            TcpPeripheral_turnoutBeans.append((turnout, gpio, id))
+            TcpPeripheral_deviceIds.add(id)
+    for id in TcpPeripheral_deviceIds:
+        TcpPeripheral_addDevice(id)
+    TcpPeripheral_waitDevices()
+    for sensor, gpio, id in TcpPeripheral_sensorBeans:
+        sensor.addPropertyChangeListener(TcpPeripheral_Sensor_Listener(gpio, id))
+        if sensor.getKnownState() != jmri.Sensor.UNKNOWN:
+            sensor.setKnownState(jmri.Sensor.UNKNOWN) # the listener sends a register request to device
+        else: # no state change to detect - send the register request directly
+            TcpPeripheral_sendToDevice(False, gpio, None, id)
+    for turnout, gpio, id in TcpPeripheral_turnoutBeans:
+        currentState = turnout.getCommandedState() # get current turnout state
+        turnout.setCommandedState(jmri.Turnout.UNKNOWN) # set turnout to a state that will permit change detection by listener
+        turnout.addPropertyChangeListener(TcpPeripheral_Turnout_Listener(gpio, id))
+        if currentState in TcpPeripheral_turnoutOutput: # CLOSED or THROWN
+            turnout.setCommandedState(currentState)
@@ -28,7 +28,9 @@
 # imports, module variables and imediate running code
 
 import gpiozero
+import collections
 import socket
+import select
 import threading
 import time
 import sys
@@ -36,99 +38,130 @@ from adafruit_servokit import ServoKit
 
 CONN_TIMEOUT = 3.0 # timeout (seconds)
 MAX_HEARTBEAT_FAIL = 5 # multiply by CONN_TIMEOUT for maximum time interval (send heartbeat after CONN_TIMEOUT * (MAX_HEARTBEAT_FAIL / 2))
+RECV_BUFFER_SIZE = 4096 # receive buffer (bytes) - maximum length of a command
 
 gpioOUT = {}
 gpioIN = {}
 servoTURNOUT = {}
+outQueue = collections.deque() # input status messages waiting to be sent
+outEvent = threading.Event() # set when there are messages in outQueue
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 # this is the code to be executed when an input is activated
 def inputActivated(input):
-    msg = "IN:" + str(input.pin.number) + ":1"
-    sock.send(msg)
+    outQueue.append(b"IN:%d:1|" % input.pin.number) # ready to send (including delimiter)
+    outEvent.set()
     return
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 # this is the code to be executed when an input is deactivated
 def inputDeactivated(input):
-    msg = "IN:" + str(input.pin.number) + ":0"
-    sock.send(msg)
+    outQueue.append(b"IN:%d:0|" % input.pin.number) # ready to send (including delimiter)
+    outEvent.set()
+    return
+
+#+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# this is the code to be executed to send the queued input status messages (runs on its own thread, so GPIO callbacks never wait for the socket)
+def outputWriter():
+    while True:
+        outEvent.wait()
+        outEvent.clear()
+        msgs = []
+        while outQueue: # everything queued until now goes in a single message
+            msgs.append(outQueue.popleft())
+        if msgs:
+            sock.sendRaw(b"".join(msgs))
     return
 
 #=================================================================================
 # define the TCP server callback class
 class serverTcpThread_callback(object):
 
+#---------------------------------------------------------------------------------
+# this is the code to be executed when the class is instantiated
+    def __init__(self):
+        self.handlers = {"OUT": self.processOutCmd, "IN": self.processInCmd} # command prefix -> handler (built only once)
+        return
+
 #---------------------------------------------------------------------------------
 # this is the code to be executed when a message is received
     def processRecvMsg(self, serverTcpThread, msg):
         print ("From '" + serverTcpThread.client + "': Received [" + msg + "]")
         cmdParams = msg.split(":")
-        if len(cmdParams) < 2 or (cmdParams[0].upper() != "OUT" and cmdParams[0].upper() != "IN"): # generic error
+        handler = self.handlers.get(cmdParams[0].upper())
+        if len(cmdParams) < 2 or handler is None: # generic error
             msg = "ERROR"
             serverTcpThread.send(msg)
             return
-        inout = cmdParams[0].upper()
         try:
             pin = int(cmdParams[1])
         except: # invalid GPIO
             pin = 9999
-        if inout == "OUT":
-            if len(cmdParams) != 3: # error for OUT command
-                msg = inout + ":" + str(pin) + ":ERROR"
-                serverTcpThread.send(msg)
-                return
-            if pin not in gpioOUT: # try to configure GPIO as output and add it to the list
-                if pin in gpioIN: # already defined for input
-                    gpioIN[pin].close() # close it and free resources
-                    del gpioIN[pin] # remove it
-                try:
-                    gpioAux = gpiozero.LED(pin)
-                except:
-                    msg = inout + ":" + str(pin) + ":ERROR"
-                    serverTcpThread.send(msg)
-                    return
-                else:
-                    gpioOUT[pin] = gpioAux
-                print ("GPIO " + str(pin) + " set to output")
+        handler(serverTcpThread, pin, cmdParams)
+        return
+
+#---------------------------------------------------------------------------------
+# this is the code to be executed for an OUT command (change output GPIO)
+    def processOutCmd(self, serverTcpThread, pin, cmdParams):
+        if len(cmdParams) != 3: # error for OUT command
+            msg = "OUT:" + str(pin) + ":ERROR"
+            serverTcpThread.send(msg)
+            return
+        if pin not in gpioOUT: # try to configure GPIO as output and add it to the list
+            if pin in gpioIN: # already defined for input
+                gpioIN[pin].close() # close it and free resources
+                del gpioIN[pin] # remove it
             try:
-                status = int(cmdParams[2])
-            except: # invalid status
-                status = 0
-            if status == 0:
-                gpioOUT[pin].off()
-                print ("GPIO " + str(pin) + " OUT set to 0")
-            else:
-                gpioOUT[pin].on()
-                print ("GPIO " + str(pin) + " OUT set to 1")
-        if inout == "IN":
-            if len(cmdParams) != 2: # error for IN command
-                msg = inout + ":" + str(pin) + ":ERROR"
+                gpioAux = gpiozero.LED(pin)
+            except:
+                msg = "OUT:" + str(pin) + ":ERROR"
                 serverTcpThread.send(msg)
                 return
-            if pin not in gpioIN: # try to configure GPIO as input and add it to the list
-                if pin in gpioOUT: # already defined for output
-                    gpioOUT[pin].close() # close it and free resources
-                    del gpioOUT[pin] # remove it
-                try:
-                    gpioAux = gpiozero.Button(pin, True) # pullup resistor
+            else:
+                gpioOUT[pin] = gpioAux
+            print ("GPIO " + str(pin) + " set to output")
+        try:
+            status = int(cmdParams[2])
+        except: # invalid status
+            status = 0
+        if status == 0:
+            gpioOUT[pin].off()
+            print ("GPIO " + str(pin) + " OUT set to 0")
+        else:
+            gpioOUT[pin].on()
+            print ("GPIO " + str(pin) + " OUT set to 1")
+        return
+
+#---------------------------------------------------------------------------------
+# this is the code to be executed for an IN command (request input GPIO status)
+    def processInCmd(self, serverTcpThread, pin, cmdParams):
+        if len(cmdParams) != 2: # error for IN command
+            msg = "IN:" + str(pin) + ":ERROR"
+            serverTcpThread.send(msg)
+            return
+        if pin not in gpioIN: # try to configure GPIO as input and add it to the list
+            if pin in gpioOUT: # already defined for output
+                gpioOUT[pin].close() # close it and free resources
+                del gpioOUT[pin] # remove it
+            try:
+                gpioAux = gpiozero.Button(pin, True) # pullup resistor
 # to apply different settings for input pins, add code here ...
 # example (no pullup resistor for pin 3 input):
-#                   if pin == 3:
-#                       gpioAux = gpiozero.Button(pin, False)
-                except:
-                    msg = inout + ":" + str(pin) + ":ERROR"
-                    serverTcpThread.send(msg.encode())
-                    return
-                else:
-                    gpioIN[pin] = gpioAux
-                    gpioIN[pin].when_pressed = inputActivated
-                    gpioIN[pin].when_released = inputDeactivated
-            print ("GPIO " + str(pin) + " registered for input")
-            if gpioIN[pin].is_pressed:
-                inputActivated(gpioIN[pin])
+#               if pin == 3:
+#                   gpioAux = gpiozero.Button(pin, False)
+            except:
+                msg = "IN:" + str(pin) + ":ERROR"
+                serverTcpThread.send(msg)
+                return
             else:
-                inputDeactivated(gpioIN[pin])
+                gpioIN[pin] = gpioAux
+                gpioIN[pin].when_pressed = inputActivated
+                gpioIN[pin].when_released = inputDeactivated
+        print ("GPIO " + str(pin) + " registered for input")
+        if gpioIN[pin].is_pressed:
+            inputActivated(gpioIN[pin])
+        else:
+            inputDeactivated(gpioIN[pin])
         return
 
 #---------------------------------------------------------------------------------
@@ -149,58 +182,74 @@ class serverTcpThread(threading.Thread):
         self.callback = callback
         self.port = port
         self.client = ""
-        self.received = ""
+        self.received = bytearray(RECV_BUFFER_SIZE) # received data is written directly into this buffer
+        self.receivedView = memoryview(self.received)
+        self.receivedLen = 0 # length of the unterminated command at the buffer start
         self.isAtive = False
+        self.ready = threading.Event() # set while connected
         self.exit = False
         self.sock = None
+        self.listenSock = None
+        self.sendLock = threading.Lock()
         return
 
 #---------------------------------------------------------------------------------
 # this is the code to be executed on start
     def run(self):
         self.connect() # connect
-        heartbeatFailCount = 0
         heartbeatCtrl = time.time() # start heartbeat delay
+        receivedCtrl = time.time() # start heartbeat timeout
         while not self.exit:
-            if (time.time() - heartbeatCtrl) > (CONN_TIMEOUT * (MAX_HEARTBEAT_FAIL / 2)): # send only after appropriate delay
-                msg = " "
-                self.sock.sendall(msg.encode()) # send heartbeat
-                heartbeatCtrl = time.time() # restart heartbeat delay
-
             try:
-                received = self.sock.recv(256)
-                received = received.decode()
-                if received:
-                    print ("'" + self.client + "': Received (including heartbeat) [" + received + "]")
-                    heartbeatFailCount = 0
-                    self.received += received.replace(" ", "") # remove spaces (heartbeat)
-                    cmds = self.received.split("|")
-                    if len(cmds) > 0:
-                        for cmd in cmds:
+                if (time.time() - heartbeatCtrl) > (CONN_TIMEOUT * (MAX_HEARTBEAT_FAIL / 2)): # send only after appropriate delay
+                    msg = " "
+                    with self.sendLock:
+                        self.sock.sendall(msg.encode()) # send heartbeat
+                    heartbeatCtrl = time.time() # restart heartbeat delay
+                waitTime = min(heartbeatCtrl + (CONN_TIMEOUT * (MAX_HEARTBEAT_FAIL / 2)), receivedCtrl + (CONN_TIMEOUT * MAX_HEARTBEAT_FAIL)) - time.time()
+                readable = select.select([self.sock], [], [], max(waitTime, 0))[0] # wait for data, next heartbeat or heartbeat timeout
+                if readable:
+                    count = self.sock.recv_into(self.receivedView[self.receivedLen:]) # append to the unterminated command
+                    if count:
+                        end = self.receivedLen + count
+                        print ("'" + self.client + "': Received (including heartbeat) [" + self.received[self.receivedLen:end].decode() + "]")
+                        receivedCtrl = time.time() # restart heartbeat timeout
+                        start = 0
+                        procChars = self.received.find(b"|", self.receivedLen, end) # only the new data may have a delimiter
+                        while procChars >= 0:
+                            cmd = self.received[start:procChars].replace(b" ", b"") # remove spaces (heartbeat)
                             if cmd: # if not empty
-                                self.callback.processRecvMsg(self, cmd)
-                        procChars = self.received.rfind("|")
-                        self.received = self.received[procChars:]
-                else:
-                    print ("'" + self.client + "': Connection broken - closing socket")
-                    self.sock.close()
-                    self.isAtive = False
-                    self.connect() # reconnect
-                    heartbeatFailCount = 0
-            except socket.timeout as e:
-                heartbeatFailCount += 1
-                if heartbeatFailCount > MAX_HEARTBEAT_FAIL:
+                                self.callback.processRecvMsg(self, cmd.decode())
+                            start = procChars + 1
+                            procChars = self.received.find(b"|", start, end)
+                        while start < end and self.received[start] == 0x20: # drop heartbeats not followed by a command
+                            start += 1
+                        self.receivedLen = end - start
+                        self.received[:self.receivedLen] = self.received[start:end] # keep the unterminated command at the buffer start
+                        if self.receivedLen == RECV_BUFFER_SIZE: # no delimiter in a full buffer
+                            print ("'" + self.client + "': Command too long - discarded")
+                            self.receivedLen = 0
+                    else:
+                        print ("'" + self.client + "': Connection broken - closing socket")
+                        self.sock.close()
+                        self.isAtive = False
+                        self.ready.clear()
+                        self.connect() # reconnect
+                        receivedCtrl = time.time()
+                elif (time.time() - receivedCtrl) > (CONN_TIMEOUT * MAX_HEARTBEAT_FAIL):
                     print ("'" + self.client + "': Heartbeat timeout - closing socket")
                     self.sock.close()
                     self.isAtive = False
+                    self.ready.clear()
                     self.connect() # reconnect
-                    heartbeatFailCount = 0
-            except socket.error as e:
-                print ("'" + self.client + "': " + e + " - Connection reset by peer - closing socket")
+                    receivedCtrl = time.time()
+            except (socket.error, ValueError) as e: # ValueError - select on a socket closed by stop()
+                print ("'" + self.client + "': " + str(e) + " - Connection reset by peer - closing socket")
                 self.sock.close()
                 self.isAtive = False
+                self.ready.clear()
                 self.connect() # reconnect
-                heartbeatFailCount = 0
+                receivedCtrl = time.time()
         self.callback.onFinished(self, "Finished")
         return
 
@@ -208,42 +257,63 @@ class serverTcpThread(threading.Thread):
 # this is the code to be executed to connect or reconnect
     def connect(self):
         server_address = ("", self.port)
-        while not self.exit:
+        while (self.listenSock == None) and (not self.exit): # bind only once (kept for all reconnections)
             try:
                 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # rebind at once after a restart (port may still be in TIME_WAIT)
                 sock.bind(server_address)
                 sock.settimeout(None)
+                sock.listen(1)
             except socket.error as e:
                 print ("Binding: ERROR - " + str(e))
                 sock = None
                 time.sleep(CONN_TIMEOUT)
             else:
-                break # continue because binding is done
+                self.listenSock = sock # continue because binding is done
         while not self.exit:
             print ("Waiting for incoming socket connection to port " + str(self.port) + " on this device")
             try:
-                sock.listen(1)
-                self.sock, client_address = sock.accept()
+                self.sock, client_address = self.listenSock.accept()
                 self.client = client_address[0] + ":" + str(client_address[1])
-                self.sock.settimeout(None)
+                self.receivedLen = 0 # discard any unterminated command from a previous connection
+                self.sock.settimeout(CONN_TIMEOUT) # limit how long sendall/recv may block (select handles the heartbeat wake-ups)
             except socket.error as e:
                 self.sock = None
                 time.sleep(CONN_TIMEOUT)
             else:
+                try: # best effort (the connection also works without these options)
+                    self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # send short messages immediately (no Nagle delay)
+                    self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) # let the OS detect half-open connections
+                    if hasattr(socket, "TCP_KEEPIDLE"): # keepalive timing is only tunable on some platforms (e.g. Linux)
+                        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, int(CONN_TIMEOUT * MAX_HEARTBEAT_FAIL))
+                        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, int(CONN_TIMEOUT))
+                        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, MAX_HEARTBEAT_FAIL)
+                except socket.error as e:
+                    print ("'" + self.client + "': Socket options not set - " + str(e))
                 print ("'" + self.client + "': Connected to port " + str(self.port) + " on this device")
                 self.isAtive = True
+                self.ready.set()
                 break # continue because connection is done
         return
 
 #---------------------------------------------------------------------------------
 # this is the code to be executed to send a message
     def send(self, msg):
-        while (not self.isAtive) and (not self.exit):
-            time.sleep(1) # wait until active or to exit
+        self.sendRaw((msg + "|").encode()) # add end of command delimiter
+        return
+
+#---------------------------------------------------------------------------------
+# this is the code to be executed to send bytes already including the end of command delimiter
+    def sendRaw(self, data):
+        while (not self.exit) and (not self.ready.wait(CONN_TIMEOUT)):
+            pass # wait until active or to exit
         if self.isAtive:
-            print ("To '" + self.client + "', sending message:", msg)
-            msg = msg + "|"
-            self.sock.sendall(msg.encode()) # add end of command delimiter
+            print ("To '" + self.client + "', sending message:", data.decode())
+            try:
+                with self.sendLock: # messages from different threads are never mixed
+                    self.sock.sendall(data)
+            except socket.error as e: # the receiving loop will detect it and reconnect
+                print ("'" + self.client + "': " + str(e) + " - Error sending")
         return
 
 #---------------------------------------------------------------------------------
@@ -256,6 +326,7 @@ class serverTcpThread(threading.Thread):
             pass
         finally:
             self.isAtive = False
+            self.ready.clear()
             self.exit = True
         return
 
@@ -271,5 +342,7 @@ else:
     port = 10000 # default
 sock = serverTcpThread(serverTcpThread_callback(), port)
 sock.start()
-while True:
-    pass
+writer = threading.Thread(target=outputWriter)
+writer.daemon = True
+writer.start()
+sock.join() # wait without using the CPU (the socket thread runs until the power is turned off)
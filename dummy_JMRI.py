@@ -85,13 +85,12 @@ class clientTcpThread(threading.Thread):
                     print (self.alias + ": Received (including heartbeat) [" + received + "]")
                     heartbeatFailCount = 0
                     self.received += received.replace(" ", "") # remove spaces (heartbeat)
-                    cmds = self.received.split("|")
-                    if len(cmds) > 0:
+                    if "|" in self.received: # at least one complete command
+                        cmds = self.received.split("|")
+                        self.received = cmds.pop() # keep the unterminated command until the rest is received
                         for cmd in cmds:
                             if cmd: # if not empty
                                 self.callback.processRecvMsg(self, cmd)
-                        procChars = self.received.rfind("|")
-                        self.received = self.received[procChars:]
                 else:
                     print (self.alias + ": Connection broken - closing socket")
                     self.sock.close()